@@ -1,7 +1,9 @@
 # config.py
 import os
+from functools import lru_cache
+from typing import List
 from dotenv import load_dotenv
-from pydantic import BaseSettings
+from pydantic_settings import BaseSettings
 
 load_dotenv()
 
@@ -15,10 +17,23 @@ class Settings(BaseSettings):
     MSFT_TENANT_ID: str = os.environ.get("MSFT_TENANT_ID", "common")
     MSAL_TOKEN_FILE: str = os.environ.get("MSAL_TOKEN_FILE", "msal_token.json")
 
-    # Default MS Graph scopes used
-    MSFT_SCOPES = ["https://graph.microsoft.com/.default"] if MSFT_CLIENT_SECRET else ["Files.ReadWrite.All", "offline_access", "User.Read"]
+    # Concurrent OneDrive uploads; kept conservative to stay clear of Graph throttling
+    ONEDRIVE_UPLOAD_WORKERS: int = int(os.environ.get("ONEDRIVE_UPLOAD_WORKERS", 4))
 
     PORT: int = int(os.environ.get("PORT", 8000))
 
+    @property
+    def MSFT_SCOPES(self) -> List[str]:
+        # Default MS Graph scopes used; app-only auth must request .default
+        if self.MSFT_CLIENT_SECRET:
+            return ["https://graph.microsoft.com/.default"]
+        return ["Files.ReadWrite.All", "offline_access", "User.Read"]
 
-settings = Settings()
\ No newline at end of file
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide Settings, reading the environment only on first call."""
+    return Settings()
+
+
+settings = get_settings()
\ No newline at end of file
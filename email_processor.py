@@ -2,22 +2,30 @@
 """
 Gmail API helper functions:
 - build_gmail_service: build authorized Gmail API service using OAuth2 token.json
+- get_gmail_service: cached per-thread Gmail API service
 - search_messages_with_attachments: find message IDs with attachments
 - download_attachments_from_messages: download attachments to folder
+- iter_attachments: yield attachments as (filename, bytes) without touching disk
 - send_message_with_attachment: send an email with an attachment
 """
 import os
 import base64
 import json
+import tempfile
+import threading
+import time
+from collections import Counter
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from typing import List, Dict
+from googleapiclient.http import MediaIoBaseUpload
+from typing import List, Dict, Set, Iterator, Tuple
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email import encoders
+from email.generator import BytesGenerator
 
 from config import settings
 
@@ -28,6 +36,19 @@ SCOPES = [
     # add more scopes if you need modify permissions
 ]
 
+# messages.get calls per batch request; Gmail allows 100 but larger batches trip per-user rate limits
+BATCH_SIZE = 50
+# Sub-requests failing with these statuses (rate limits, transient errors) are re-batched with backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+
+# Partial response for messages.get: part structure and attachment IDs only, no body data
+ATTACHMENT_PARTS_FIELDS = "id,payload/parts(partId,filename,mimeType,body/attachmentId,body/size)"
+
+# Base64 text decoded per write; a multiple of 4 so every slice decodes on its own
+DECODE_CHUNK_SIZE = 64 * 1024
+
 
 def build_gmail_service():
     """
@@ -64,16 +85,74 @@ def build_gmail_service():
     return service
 
 
+# Per-thread service cache: the underlying httplib2 connection is not thread-safe
+_service_cache = threading.local()
+
+
+def get_gmail_service():
+    """
+    Return a Gmail API service for the current thread, building it on first use.
+    Credentials refresh themselves on expiry, so the service can be reused across requests.
+    """
+    service = getattr(_service_cache, "service", None)
+    if service is None:
+        service = _service_cache.service = build_gmail_service()
+    return service
+
+
 def search_messages_with_attachments(service, query: str, max_results: int = 50) -> List[Dict]:
     """
     Search messages matching a query and return message resource dicts that have attachments.
+    Returned resources only carry the payload part structure (filenames and attachment IDs),
+    which is all download_attachments_from_messages needs.
     """
+    # Let Gmail pre-filter so we only fetch messages that can carry attachments
+    if "has:attachment" not in query:
+        query = f"{query} has:attachment".strip()
     try:
         results = service.users().messages().list(userId="me", q=query, maxResults=max_results).execute()
         messages = results.get("messages", [])
+        fetched = {}
+        retryable = {}
+        errors = []
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif isinstance(exception, HttpError) and exception.resp.status in RETRY_STATUSES:
+                retryable[request_id] = exception
+            else:
+                errors.append(exception)
+
+        ids = [m["id"] for m in messages]
+        for attempt in range(MAX_RETRIES + 1):
+            # One HTTP round-trip per BATCH_SIZE messages instead of one per message
+            for i in range(0, len(ids), BATCH_SIZE):
+                batch = service.new_batch_http_request(callback=collect)
+                for message_id in ids[i:i + BATCH_SIZE]:
+                    request = service.users().messages().get(
+                        userId="me", id=message_id, format="full", fields=ATTACHMENT_PARTS_FIELDS
+                    )
+                    batch.add(request, request_id=message_id)
+                try:
+                    batch.execute()
+                except HttpError as e:
+                    if e.resp.status not in RETRY_STATUSES:
+                        raise
+                    retryable.update((message_id, e) for message_id in ids[i:i + BATCH_SIZE])
+            if errors:
+                raise errors[0]
+            if not retryable:
+                break
+            if attempt == MAX_RETRIES:
+                raise next(iter(retryable.values()))
+            ids = list(retryable)
+            retryable.clear()
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
         found = []
         for m in messages:
-            msg = service.users().messages().get(userId="me", id=m["id"], format="full").execute()
+            msg = fetched[m["id"]]
             if "payload" in msg and "parts" in msg["payload"]:
                 # crude check for attachment part
                 parts = msg["payload"].get("parts", [])
@@ -87,11 +166,33 @@ def search_messages_with_attachments(service, query: str, max_results: int = 50)
 
 def download_attachments_from_messages(service, messages: List[Dict], download_folder: str) -> List[str]:
     """
-    Given messages (full message resources), downloads attachments to download_folder.
+    Given messages (as returned by search_messages_with_attachments), downloads attachments to download_folder.
     Returns list of saved file paths.
+    download_folder is expected to be empty (callers use a fresh temp dir), so duplicate
+    filenames are disambiguated in memory without checking the filesystem.
     """
     saved_files = []
     os.makedirs(download_folder, exist_ok=True)
+    for filename, data in _iter_attachment_data(service, messages):
+        save_path = os.path.join(download_folder, filename)
+        _write_base64_to_file(data, save_path)
+        saved_files.append(save_path)
+    return saved_files
+
+
+def iter_attachments(service, messages: List[Dict]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (filename, decoded bytes) for each attachment in messages, one at a time.
+    Filenames are disambiguated the same way as download_attachments_from_messages.
+    """
+    for filename, data in _iter_attachment_data(service, messages):
+        yield filename, base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _iter_attachment_data(service, messages: List[Dict]) -> Iterator[Tuple[str, str]]:
+    # Yields (unique filename, URL-safe base64 data) per attachment part
+    seen = Counter()
+    used = set()
     for msg in messages:
         msg_id = msg["id"]
         parts = msg["payload"].get("parts", [])
@@ -102,24 +203,37 @@ def download_attachments_from_messages(service, messages: List[Dict], download_f
                 if "attachmentId" in body:
                     attach_id = body["attachmentId"]
                     attachment = service.users().messages().attachments().get(userId="me", messageId=msg_id, id=attach_id).execute()
-                    data = attachment.get("data")
-                    file_data = base64.urlsafe_b64decode(data.encode("UTF-8"))
-                    save_path = os.path.join(download_folder, filename)
-                    # Ensure unique filename
-                    base, ext = os.path.splitext(save_path)
-                    i = 1
-                    while os.path.exists(save_path):
-                        save_path = f"{base}_{i}{ext}"
-                        i += 1
-                    with open(save_path, "wb") as f:
-                        f.write(file_data)
-                    saved_files.append(save_path)
-    return saved_files
+                    yield _unique_name(filename, seen, used), attachment.get("data")
+
+
+def _unique_name(filename: str, seen: Counter, used: Set[str]) -> str:
+    """Return filename, or filename_N.ext if it was already handed out in this batch."""
+    base, ext = os.path.splitext(filename)
+    n = seen[filename]
+    name = filename if n == 0 else f"{base}_{n}{ext}"
+    # A suffixed name can still clash with a real attachment of that name
+    while name in used:
+        n += 1
+        name = f"{base}_{n}{ext}"
+    seen[filename] = n + 1
+    used.add(name)
+    return name
+
+
+def _write_base64_to_file(data: str, path: str) -> None:
+    """Decode URL-safe base64 text to path slice by slice, never holding the whole decoded payload."""
+    # Gmail may strip trailing padding; restore it so the final slice decodes
+    data += "=" * (-len(data) % 4)
+    with open(path, "wb") as f:
+        for i in range(0, len(data), DECODE_CHUNK_SIZE):
+            f.write(base64.urlsafe_b64decode(data[i:i + DECODE_CHUNK_SIZE]))
 
 
 def send_message_with_attachment(service, to: str, subject: str, body_text: str, file_path: str):
     """
     Send an email with an attachment via Gmail API.
+    The MIME message is spooled to a temp file and sent with a resumable media upload,
+    so it is never held as a second base64-encoded copy for the JSON "raw" field.
     """
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Attachment not found: {file_path}")
@@ -136,9 +250,15 @@ def send_message_with_attachment(service, to: str, subject: str, body_text: str,
     part.add_header("Content-Disposition", f'attachment; filename="{os.path.basename(file_path)}"')
     message.attach(part)
 
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    try:
-        sent = service.users().messages().send(userId="me", body={"raw": raw}).execute()
-        return {"id": sent.get("id")}
-    except Exception as e:
-        raise RuntimeError(f"Failed to send message: {e}")
\ No newline at end of file
+    with tempfile.TemporaryFile() as raw:
+        # Same serialization as message.as_bytes(), written straight to the spool file
+        BytesGenerator(raw, mangle_from_=False).flatten(message)
+        # The spool file now holds the message; release the encoded attachment before uploading
+        del message, part
+        raw.seek(0)
+        media = MediaIoBaseUpload(raw, mimetype="message/rfc822", resumable=True)
+        try:
+            sent = service.users().messages().send(userId="me", media_body=media).execute()
+            return {"id": sent.get("id")}
+        except Exception as e:
+            raise RuntimeError(f"Failed to send message: {e}")
\ No newline at end of file
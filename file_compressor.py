@@ -1,17 +1,250 @@
 # file_compressor.py
-import zipfile
+"""
+Zip archive helper.
+
+Entries are DEFLATE-compressed with zlib-ng when the optional `zlib-ng` package is
+installed (SIMD match-finding and CRC32), otherwise with the stdlib zlib. The zip
+container is written here directly so the compression backend is not tied to zipfile,
+and so entries can be compressed in parallel and then written out in order.
+"""
 import os
-from typing import List
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Iterable, List, Optional, Tuple
+
+try:
+    from zlib_ng import zlib_ng as zlib
+except ImportError:
+    import zlib
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+_ZIP64_LOCATOR = struct.Struct("<4sLQL")
+_ZIP_VERSION = 20  # 2.0: DEFLATE
+_ZIP64_VERSION = 45  # 4.5: ZIP64 extensions
+_ZIP64_EXTRA_ID = 0x0001
+_UTF8_FLAG = 0x800
+# Same thresholds as zipfile: values above these move to ZIP64 fields
+_ZIP32_LIMIT = (1 << 31) - 1
+_ZIP32_MAX_ENTRIES = 0xFFFF
+_ZIP32_MARKER = 0xFFFFFFFF
 
+DEFAULT_COMPRESSLEVEL = 1
+# Large reads amortize syscalls and give the match-finder more input per call
+READ_SIZE = 256 * 1024
+# Compressed entries waiting to be written stay in memory up to this size, then spill to disk
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+# Both zlib backends release the GIL while compressing, so threads scale across cores
+COMPRESS_WORKERS = os.cpu_count() or 1
 
-def compress_files(file_paths: List[str], output_zip: str) -> None:
+# Already-compressed formats; deflating them again costs CPU and rarely saves space
+STORED_EXTENSIONS = frozenset({
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".pdf", ".docx", ".xlsx", ".pptx",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar",
+    ".mp3", ".mp4", ".m4a", ".mov",
+})
+
+# One read buffer per worker thread, reused for every entry that thread compresses
+_buffers = threading.local()
+
+
+def compress_files(file_paths: List[str], output_zip: str, compresslevel: int = DEFAULT_COMPRESSLEVEL) -> None:
     """
     Compress the provided list of files into output_zip (overwrites if exists).
+    compresslevel is the DEFLATE level, 0 (store) to 9 (smallest). The default of 1 is
+    several times faster than zlib's usual 6 for a few percent larger output, which suits
+    archives that are only built to be emailed. Files in STORED_EXTENSIONS are stored as-is.
     """
+    # Check every input up front so a bad path fails before any output is written
+    missing = [f for f in file_paths if not os.path.isfile(f)]
+    if missing:
+        raise FileNotFoundError(f"File does not exist: {', '.join(missing)}")
     os.makedirs(os.path.dirname(output_zip) or ".", exist_ok=True)
-    with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zf:
-        for f in file_paths:
-            if not os.path.exists(f):
-                raise FileNotFoundError(f"File does not exist: {f}")
-            arcname = os.path.basename(f)
-            zf.write(f, arcname=arcname)
\ No newline at end of file
+    infos = []
+    with open(output_zip, "wb") as out, ThreadPoolExecutor(max_workers=COMPRESS_WORKERS) as ex:
+        # Files are compressed concurrently and written in input order. New files are submitted
+        # only as entries are written, so a slow entry holds back at most COMPRESS_WORKERS results.
+        paths = iter(file_paths)
+        pending = deque()
+        for path in paths:
+            pending.append((path, ex.submit(_compress_entry, path, compresslevel)))
+            if len(pending) >= COMPRESS_WORKERS:
+                break
+        while pending:
+            path, future = pending.popleft()
+            zinfo, spool = future.result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, ex.submit(_compress_entry, next_path, compresslevel)))
+            # Stored entries have no spool; they are copied from the source file unchanged
+            src = spool if spool is not None else open(path, "rb")
+            with src, _entry(out, zinfo):
+                shutil.copyfileobj(src, out, READ_SIZE)
+            infos.append(zinfo)
+        _write_central_directory(out, infos)
+
+
+def compress_entries(entries: Iterable[Tuple[str, bytes]], output_zip: str, compresslevel: int = DEFAULT_COMPRESSLEVEL) -> None:
+    """
+    Compress in-memory (arcname, data) entries into output_zip (overwrites if exists).
+    entries is consumed lazily, so a generator keeps only one entry in memory at a time.
+    """
+    os.makedirs(os.path.dirname(output_zip) or ".", exist_ok=True)
+    infos = []
+    with open(output_zip, "wb") as out:
+        for arcname, data in entries:
+            zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            zinfo.external_attr = 0o600 << 16  # same default as zipfile.writestr
+            zinfo.compress_type = _compress_type(arcname)
+            zinfo.CRC = zlib.crc32(data)
+            zinfo.file_size = len(data)
+            with _entry(out, zinfo):
+                if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+                    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+                    view = memoryview(data)
+                    for i in range(0, len(view), READ_SIZE):
+                        out.write(compressor.compress(view[i:i + READ_SIZE]))
+                    out.write(compressor.flush())
+                else:
+                    out.write(data)
+            infos.append(zinfo)
+        _write_central_directory(out, infos)
+
+
+def _compress_entry(path: str, compresslevel: int) -> Tuple[zipfile.ZipInfo, Optional[IO[bytes]]]:
+    # Returns zinfo (CRC and file_size set) and, for deflated entries, a rewound spool of the payload
+    zinfo = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(path), strict_timestamps=False)
+    zinfo.compress_type = _compress_type(zinfo.filename)
+    if zinfo.compress_type == zipfile.ZIP_STORED:
+        zinfo.CRC, zinfo.file_size = _read_entry(path)
+        return zinfo, None
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    zinfo.CRC, zinfo.file_size = _read_entry(path, compressor, spool)
+    spool.seek(0)
+    return zinfo, spool
+
+
+def _compress_type(arcname: str) -> int:
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _read_entry(path: str, compressor=None, dst: Optional[IO[bytes]] = None) -> Tuple[int, int]:
+    """Return (CRC32, size) of the file at path; with a compressor, also stream its output into dst."""
+    buf = _read_buffer()
+    crc = 0
+    size = 0
+    # Unbuffered: readinto fills our buffer directly without an intermediate io buffer copy
+    with open(path, "rb", buffering=0) as src:
+        while True:
+            n = src.readinto(buf)
+            if not n:
+                break
+            block = buf[:n]
+            crc = zlib.crc32(block, crc)
+            size += n
+            if compressor:
+                dst.write(compressor.compress(block))
+    if compressor:
+        dst.write(compressor.flush())
+    return crc, size
+
+
+def _read_buffer() -> memoryview:
+    buf = getattr(_buffers, "buf", None)
+    if buf is None:
+        buf = _buffers.buf = memoryview(bytearray(READ_SIZE))
+    return buf
+
+
+def _encode_name(zinfo: zipfile.ZipInfo) -> Tuple[bytes, int]:
+    try:
+        return zinfo.filename.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return zinfo.filename.encode("utf-8"), _UTF8_FLAG
+
+
+def _dos_datetime(zinfo: zipfile.ZipInfo) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = zinfo.date_time
+    return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+
+@contextmanager
+def _entry(out, zinfo: zipfile.ZipInfo):
+    """
+    Write the local header for zinfo (CRC and file_size already set), let the caller stream the
+    payload straight to out, then seek back and patch the compressed size in, as zipfile does.
+    """
+    # Compressed output can slightly exceed its input, so reserve ZIP64 fields on the same rule as zipfile
+    zip64 = zinfo.file_size * 1.05 > _ZIP32_LIMIT
+    zinfo.header_offset = out.tell()
+    zinfo.compress_size = 0
+    _write_local_header(out, zinfo, zip64)
+    start = out.tell()
+    yield
+    end = out.tell()
+    zinfo.compress_size = end - start
+    if not zip64 and zinfo.compress_size > _ZIP32_LIMIT:
+        raise zipfile.LargeZipFile(f"Compressed size of {zinfo.filename} too large for a non-ZIP64 entry")
+    out.seek(zinfo.header_offset)
+    _write_local_header(out, zinfo, zip64)
+    out.seek(end)
+
+
+def _write_local_header(out, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+    name, flags = _encode_name(zinfo)
+    dos_time, dos_date = _dos_datetime(zinfo)
+    if zip64:
+        extra = struct.pack("<2H2Q", _ZIP64_EXTRA_ID, 16, zinfo.file_size, zinfo.compress_size)
+        version, compress_size, file_size = _ZIP64_VERSION, _ZIP32_MARKER, _ZIP32_MARKER
+    else:
+        extra = b""
+        version, compress_size, file_size = _ZIP_VERSION, zinfo.compress_size, zinfo.file_size
+    out.write(_LOCAL_HEADER.pack(
+        b"PK\x03\x04", version, flags, zinfo.compress_type, dos_time, dos_date,
+        zinfo.CRC, compress_size, file_size, len(name), len(extra),
+    ))
+    out.write(name)
+    out.write(extra)
+
+
+def _write_central_directory(out, infos: List[zipfile.ZipInfo]) -> None:
+    start = out.tell()
+    for zinfo in infos:
+        name, flags = _encode_name(zinfo)
+        dos_time, dos_date = _dos_datetime(zinfo)
+        # Values too large for their ZIP32 field go into the ZIP64 extra, in the spec's fixed order
+        values = (zinfo.file_size, zinfo.compress_size, zinfo.header_offset)
+        wide = [v for v in values if v > _ZIP32_LIMIT]
+        file_size, compress_size, header_offset = (_ZIP32_MARKER if v > _ZIP32_LIMIT else v for v in values)
+        extra = struct.pack(f"<2H{len(wide)}Q", _ZIP64_EXTRA_ID, 8 * len(wide), *wide) if wide else b""
+        version = _ZIP64_VERSION if wide else _ZIP_VERSION
+        out.write(_CENTRAL_HEADER.pack(
+            b"PK\x01\x02", zinfo.create_system << 8 | version, version, flags,
+            zinfo.compress_type, dos_time, dos_date, zinfo.CRC, compress_size, file_size,
+            len(name), len(extra), 0, 0, 0, zinfo.external_attr, header_offset,
+        ))
+        out.write(name)
+        out.write(extra)
+    end = out.tell()
+    count, size = len(infos), end - start
+    if count > _ZIP32_MAX_ENTRIES or size > _ZIP32_LIMIT or start > _ZIP32_LIMIT:
+        out.write(_ZIP64_END_RECORD.pack(
+            b"PK\x06\x06", _ZIP64_END_RECORD.size - 12, _ZIP64_VERSION, _ZIP64_VERSION,
+            0, 0, count, count, size, start,
+        ))
+        out.write(_ZIP64_LOCATOR.pack(b"PK\x06\x07", 0, end, 1))
+        count, size, start = min(count, _ZIP32_MAX_ENTRIES), min(size, _ZIP32_MARKER), min(start, _ZIP32_MARKER)
+    out.write(_END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, size, start, 0))
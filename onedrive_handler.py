@@ -10,16 +10,68 @@ Two typical patterns:
 
 This file implements a simple MSAL device flow for delegated permissions, and an upload helper.
 """
+import io
 import os
 import json
-import requests
-from msal import PublicClientApplication, ConfidentialClientApplication
-from typing import Dict
+import threading
+import time
+from functools import lru_cache
+import httpx
+from msal import PublicClientApplication, ConfidentialClientApplication, SerializableTokenCache
+from typing import Dict, Tuple
 from config import settings
 
 MSAL_TOKEN_PATH = settings.MSAL_TOKEN_FILE
 
+GRAPH_DRIVE_ROOT = "https://graph.microsoft.com/v1.0/me/drive/root"
+# Graph rejects simple uploads above 4 MiB; larger files go through an upload session
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+# Upload session chunks must be a multiple of 320 KiB
+UPLOAD_CHUNK_SIZE = 32 * 320 * 1024
 
+# One HTTP/2 client for all Graph traffic: concurrent uploads from worker threads are
+# multiplexed over a pooled TLS connection instead of each opening its own.
+_client = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        retries=3,  # connection failures only
+    ),
+    timeout=httpx.Timeout(60.0),
+)
+
+# Throttling (429) and transient 503s are retried with backoff, honouring Retry-After
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# Refresh tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+# In-process token cache keyed by scopes, so the hot path skips MSAL entirely
+_token_cache: Dict[Tuple[str, ...], Dict] = {}
+_token_lock = threading.Lock()
+
+
+def _load_token_cache() -> SerializableTokenCache:
+    # MSAL's own cache, persisted to MSAL_TOKEN_PATH so restarts can still acquire silently
+    cache = SerializableTokenCache()
+    if os.path.exists(MSAL_TOKEN_PATH):
+        with open(MSAL_TOKEN_PATH) as f:
+            cache.deserialize(f.read())
+    return cache
+
+
+_msal_cache = _load_token_cache()
+
+
+def _save_token_cache():
+    if _msal_cache.has_state_changed:
+        with open(MSAL_TOKEN_PATH, "w") as f:
+            f.write(_msal_cache.serialize())
+
+
+@lru_cache(maxsize=1)
 def _load_msal_app():
     # If CLIENT_SECRET present -> use ConfidentialClientApplication (client credentials)
     if settings.MSFT_CLIENT_SECRET:
@@ -27,12 +79,14 @@ def _load_msal_app():
             settings.MSFT_CLIENT_ID,
             authority=f"https://login.microsoftonline.com/{settings.MSFT_TENANT_ID}",
             client_credential=settings.MSFT_CLIENT_SECRET,
+            token_cache=_msal_cache,
         )
     else:
         # Public client for device code flow
         app = PublicClientApplication(
             settings.MSFT_CLIENT_ID,
             authority=f"https://login.microsoftonline.com/{settings.MSFT_TENANT_ID}",
+            token_cache=_msal_cache,
         )
     return app
 
@@ -41,10 +95,27 @@ def get_onedrive_access_token(scopes=None) -> Dict:
     """
     Acquire or load a token for Microsoft Graph.
     Returns a dict with access_token and expires_in etc.
+    Tokens are reused in-process until shortly before expiry (or MSAL's suggested refresh time).
     """
     if scopes is None:
         scopes = settings.MSFT_SCOPES
 
+    key = tuple(scopes)
+    with _token_lock:
+        cached = _token_cache.get(key)
+        if cached and time.time() < cached["_refresh_at"]:
+            return cached
+        result = _acquire_token(scopes)
+        now = time.time()
+        refresh_at = now + int(result.get("expires_in", 0)) - TOKEN_REFRESH_MARGIN
+        if "refresh_in" in result:
+            refresh_at = min(refresh_at, now + int(result["refresh_in"]))
+        result["_refresh_at"] = refresh_at
+        _token_cache[key] = result
+        return result
+
+
+def _acquire_token(scopes) -> Dict:
     app = _load_msal_app()
 
     accounts = app.get_accounts()
@@ -65,30 +136,84 @@ def get_onedrive_access_token(scopes=None) -> Dict:
             print(f"To authenticate, visit {flow['verification_uri']} and enter code: {flow['user_code']}")
             result = app.acquire_token_by_device_flow(flow)
 
+    _save_token_cache()
     if "access_token" not in result:
         raise RuntimeError(f"Could not obtain access token: {result}")
 
-    # Optionally persist token to disk (msal manages caching if you pass a cache)
     return result
 
 
 def upload_file_to_onedrive_path(token_response: Dict, local_path: str, remote_path: str) -> Dict:
     """
     Uploads a file to OneDrive at remote_path (path relative to drive root).
-    Uses the simple upload (if < 4MB) or the simple upload for smaller files. For large files, resumable upload needed.
+    Files up to 4MB use the simple upload; larger files are streamed in chunks through an upload session.
+    The file is never read fully into memory.
     remote_path example: "MyFolder/file.pdf" (no leading slash)
     """
+    with open(local_path, "rb") as f:
+        return _upload(token_response, f, os.path.getsize(local_path), remote_path)
+
+
+def upload_bytes_to_onedrive_path(token_response: Dict, data: bytes, remote_path: str) -> Dict:
+    """
+    Uploads in-memory content to OneDrive at remote_path, same as upload_file_to_onedrive_path.
+    """
+    return _upload(token_response, io.BytesIO(data), len(data), remote_path)
+
+
+def _graph_request(method: str, url: str, **kwargs) -> httpx.Response:
+    # file-like content is rewound before each retry so the full body is resent
+    content = kwargs.get("content")
+    start = content.tell() if hasattr(content, "seek") else None
+    for attempt in range(MAX_RETRIES + 1):
+        resp = _client.request(method, url, **kwargs)
+        if resp.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return resp
+        retry_after = resp.headers.get("Retry-After", "")
+        time.sleep(int(retry_after) if retry_after.isdigit() else RETRY_BACKOFF * 2 ** attempt)
+        if start is not None:
+            content.seek(start)
+    return resp
+
+
+def _upload(token_response: Dict, f, total: int, remote_path: str) -> Dict:
     access_token = token_response.get("access_token")
     if not access_token:
         raise RuntimeError("Missing access token")
 
-    # Ensure remote path is URL encoded properly
-    # Use Graph API: /me/drive/root:/remote_path:/content
-    url = f"https://graph.microsoft.com/v1.0/me/drive/root:/{remote_path}:/content"
     headers = {"Authorization": f"Bearer {access_token}"}
-    with open(local_path, "rb") as f:
-        data = f.read()
-    resp = requests.put(url, headers=headers, data=data)
-    if resp.status_code not in (200, 201):
-        raise RuntimeError(f"OneDrive upload failed: {resp.status_code} - {resp.text}")
-    return resp.json()
\ No newline at end of file
+    if total <= SIMPLE_UPLOAD_LIMIT:
+        # Use Graph API: /me/drive/root:/remote_path:/content
+        url = f"{GRAPH_DRIVE_ROOT}:/{remote_path}:/content"
+        resp = _graph_request("PUT", url, headers=headers, content=f)
+        if resp.status_code not in (200, 201):
+            raise RuntimeError(f"OneDrive upload failed: {resp.status_code} - {resp.text}")
+        return resp.json()
+    return _upload_in_session(headers, f, total, remote_path)
+
+
+def _upload_in_session(headers: Dict, f, total: int, remote_path: str) -> Dict:
+    # Create the upload session, then PUT consecutive byte ranges to its uploadUrl
+    url = f"{GRAPH_DRIVE_ROOT}:/{remote_path}:/createUploadSession"
+    body = {"item": {"@microsoft.graph.conflictBehavior": "replace"}}
+    resp = _graph_request("POST", url, headers=headers, json=body)
+    if resp.status_code != 200:
+        raise RuntimeError(f"OneDrive upload session failed: {resp.status_code} - {resp.text}")
+    upload_url = resp.json()["uploadUrl"]
+
+    start = 0
+    while True:
+        chunk = f.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        end = start + len(chunk) - 1
+        # uploadUrl is pre-authenticated; Graph rejects an Authorization header here
+        chunk_headers = {"Content-Range": f"bytes {start}-{end}/{total}", "Content-Length": str(len(chunk))}
+        resp = _graph_request("PUT", upload_url, headers=chunk_headers, content=chunk)
+        if resp.status_code in (200, 201):
+            return resp.json()
+        if resp.status_code != 202:
+            _graph_request("DELETE", upload_url)
+            raise RuntimeError(f"OneDrive chunk upload failed: {resp.status_code} - {resp.text}")
+        start = end + 1
+    raise RuntimeError(f"OneDrive upload session for {remote_path} ended without a completed item")
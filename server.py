@@ -9,24 +9,30 @@ MCP-style server exposing tools for:
 Implements a simple MCP-like tool registry with JSON schemas for inputs.
 """
 from fastapi import FastAPI, HTTPException
+import fastjsonschema
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uvicorn
+import asyncio
 import os
+import posixpath
 import tempfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from email_processor import (
-    build_gmail_service,
+    get_gmail_service,
     search_messages_with_attachments,
     download_attachments_from_messages,
+    iter_attachments,
     send_message_with_attachment,
 )
 from onedrive_handler import (
     get_onedrive_access_token,
     upload_file_to_onedrive_path,
+    upload_bytes_to_onedrive_path,
 )
-from file_compressor import compress_files
+from file_compressor import compress_files, compress_entries, DEFAULT_COMPRESSLEVEL
 from config import settings
 
 app = FastAPI(title="MCP Email <-> OneDrive Tools", version="1.0")
@@ -66,6 +72,7 @@ TOOL_DEFINITIONS = {
             "properties": {
                 "local_paths": {"type": "array", "items": {"type": "string"}},
                 "output_zip": {"type": "string", "description": "Local path for output zip file"},
+                "compresslevel": {"type": "integer", "minimum": 0, "maximum": 9, "description": "DEFLATE level (default 1)"},
             },
         },
     },
@@ -95,36 +102,84 @@ TOOL_DEFINITIONS = {
                 "onedrive_folder": {"type": "string"},
                 "recipient_email": {"type": "string"},
                 "zip_name": {"type": "string"},
+                "compresslevel": {"type": "integer", "minimum": 0, "maximum": 9},
             },
         },
     },
 }
 
 
+# Input validators compiled once at import time from each tool's input_schema
+_VALIDATORS = {name: fastjsonschema.compile(spec["input_schema"]) for name, spec in TOOL_DEFINITIONS.items()}
+
+
 @app.get("/mcp/tools")
 def list_tools():
     """Return the tool definitions (MCP-style metadata)."""
     return {"tools": TOOL_DEFINITIONS}
 
 
+def _with_gmail(fn, *args):
+    # Runs fn with this thread's Gmail service; services must not be shared across threads
+    return fn(get_gmail_service(), *args)
+
+
+async def _upload_all(token: Dict, uploads: List[Tuple[str, str]]) -> List[Dict]:
+    """Upload (local_path, remote_path) pairs concurrently, preserving input order in the results."""
+    limit = asyncio.Semaphore(settings.ONEDRIVE_UPLOAD_WORKERS)
+
+    async def upload(local_path: str, remote_path: str) -> Dict:
+        async with limit:
+            return await asyncio.to_thread(upload_file_to_onedrive_path, token, local_path, remote_path)
+
+    return await asyncio.gather(*(upload(lp, rp) for lp, rp in uploads))
+
+
+def _upload_and_zip_attachments(
+    service, messages: List[Dict], token: Dict, onedrive_folder: str, zip_path: str, compresslevel: int
+) -> Tuple[List[str], List[Dict]]:
+    """
+    Single pass over the attachments in messages: each one is fetched from Gmail, uploaded to
+    onedrive_folder in the background and compressed into zip_path, without staging it on disk.
+    Returns (attachment filenames, upload results), both in attachment order.
+    """
+    names = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=settings.ONEDRIVE_UPLOAD_WORKERS) as ex:
+
+        def entries():
+            for name, data in iter_attachments(service, messages):
+                # Bound in-flight uploads so only a few attachments are held in memory at once
+                in_flight = [f for f in futures if not f.done()]
+                if len(in_flight) >= settings.ONEDRIVE_UPLOAD_WORKERS:
+                    wait(in_flight, return_when=FIRST_COMPLETED)
+                remote_path = posixpath.join(onedrive_folder.strip("/"), name)
+                futures.append(ex.submit(upload_bytes_to_onedrive_path, token, data, remote_path))
+                names.append(name)
+                yield name, data
+
+        compress_entries(entries(), zip_path, compresslevel=compresslevel)
+        uploaded = [f.result() for f in futures]
+    return names, uploaded
+
+
 class RunRequest(BaseModel):
     tool: str
     input: Dict[str, Any]
 
 
 @app.post("/mcp/run")
-def run_tool(req: RunRequest):
+async def run_tool(req: RunRequest):
+    # Blocking Gmail/Graph/zip work runs in worker threads so the event loop stays free
     tool = req.tool
     data = req.input
     if tool not in TOOL_DEFINITIONS:
         raise HTTPException(status_code=400, detail=f"Unknown tool: {tool}")
 
-    # Validate required fields quickly
-    schema = TOOL_DEFINITIONS[tool]["input_schema"]
-    required = schema.get("required", [])
-    for r in required:
-        if r not in data:
-            raise HTTPException(status_code=400, detail=f"Missing required input: {r}")
+    try:
+        _VALIDATORS[tool](data)
+    except fastjsonschema.JsonSchemaException as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {e.message}")
 
     # Temporary working dir for operations
     work_dir = tempfile.mkdtemp(prefix="mcp_work_")
@@ -132,35 +187,35 @@ def run_tool(req: RunRequest):
         if tool == "search_and_download_attachments":
             query = data["query"]
             max_results = int(data["max_results"])
-            service = build_gmail_service()
-            messages = search_messages_with_attachments(service, query=query, max_results=max_results)
+            messages = await asyncio.to_thread(_with_gmail, search_messages_with_attachments, query, max_results)
             if not messages:
                 return {"downloaded_files": []}
-            files = download_attachments_from_messages(service, messages, download_folder=work_dir)
+            files = await asyncio.to_thread(_with_gmail, download_attachments_from_messages, messages, work_dir)
             return {"downloaded_files": files}
 
         elif tool == "upload_to_onedrive":
             local_paths = data["local_paths"]
             remote_folder = data["remote_folder_path"]
-            token = get_onedrive_access_token()
-            uploaded = []
+            token = await asyncio.to_thread(get_onedrive_access_token)
+            uploads = []
             for lp in local_paths:
                 if not os.path.isabs(lp):
                     lp = os.path.abspath(lp)
                 if not os.path.exists(lp):
                     raise HTTPException(status_code=400, detail=f"Local file not found: {lp}")
-                remote_path = os.path.join(remote_folder, os.path.basename(lp)).replace("\\", "/")
-                res = upload_file_to_onedrive_path(token, lp, remote_path)
-                uploaded.append(res)
+                remote_path = posixpath.join(remote_folder.strip("/"), os.path.basename(lp))
+                uploads.append((lp, remote_path))
+            uploaded = await _upload_all(token, uploads)
             return {"uploaded": uploaded}
 
         elif tool == "compress_files":
             local_paths = data["local_paths"]
             output_zip = data["output_zip"]
+            compresslevel = int(data.get("compresslevel", DEFAULT_COMPRESSLEVEL))
             # If output_zip not absolute, place in work_dir
             if not os.path.isabs(output_zip):
                 output_zip = os.path.join(work_dir, output_zip)
-            compress_files(local_paths, output_zip)
+            await asyncio.to_thread(compress_files, local_paths, output_zip, compresslevel)
             return {"zip_path": output_zip}
 
         elif tool == "send_zip_via_email":
@@ -168,8 +223,7 @@ def run_tool(req: RunRequest):
             subject = data["subject"]
             body = data["body"]
             zip_path = data["zip_path"]
-            service = build_gmail_service()
-            res = send_message_with_attachment(service, to, subject, body, zip_path)
+            res = await asyncio.to_thread(_with_gmail, send_message_with_attachment, to, subject, body, zip_path)
             return {"result": res}
 
         elif tool == "orchestrate_full_pipeline":
@@ -178,27 +232,24 @@ def run_tool(req: RunRequest):
             onedrive_folder = data["onedrive_folder"]
             recipient = data["recipient_email"]
             zip_name = data["zip_name"]
+            compresslevel = int(data.get("compresslevel", DEFAULT_COMPRESSLEVEL))
 
-            # 1) Search & download
-            service = build_gmail_service()
-            messages = search_messages_with_attachments(service, query=query, max_results=max_results)
+            # 1) Search
+            messages = await asyncio.to_thread(_with_gmail, search_messages_with_attachments, query, max_results)
             if not messages:
                 return {"status": "no_messages_found", "downloaded_files": []}
-            files = download_attachments_from_messages(service, messages, download_folder=work_dir)
-
-            # 2) Upload attachments to OneDrive
-            token = get_onedrive_access_token()
-            uploaded = []
-            for fpath in files:
-                remote_path = os.path.join(onedrive_folder, os.path.basename(fpath)).replace("\\", "/")
-                uploaded.append(upload_file_to_onedrive_path(token, fpath, remote_path))
 
-            # 3) Compress files
+            # 2) + 3) Fetch each attachment once, upload it to OneDrive and add it to the zip
+            token = await asyncio.to_thread(get_onedrive_access_token)
             zip_path = os.path.join(work_dir, zip_name if zip_name.endswith(".zip") else f"{zip_name}.zip")
-            compress_files(files, zip_path)
+            files, uploaded = await asyncio.to_thread(
+                _with_gmail, _upload_and_zip_attachments, messages, token, onedrive_folder, zip_path, compresslevel
+            )
 
             # 4) Send zip via Gmail
-            send_res = send_message_with_attachment(service, recipient, f"Files: {zip_name}", "See attached zip.", zip_path)
+            send_res = await asyncio.to_thread(
+                _with_gmail, send_message_with_attachment, recipient, f"Files: {zip_name}", "See attached zip.", zip_path
+            )
 
             return {
                 "downloaded_files": files,